@@ -1,20 +1,141 @@
 import json
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 import time
 from datetime import datetime, timezone
 import os
 import glob
+import hashlib
+import tempfile
+from urllib.parse import urlsplit
+
+class PerusallPageCache:
+    def __init__(self, cache_dir: str = ".perusall_cache", max_age_seconds: float = 7 * 24 * 3600):
+        """
+        Initialize the local page text cache
+        
+        Page text is stored content-addressed under objects/<sha256>.txt, and
+        each document keeps an index (documents/<sha256 of _id>.json) mapping
+        page numbers to the text hash, the source URL (without its signed query
+        string) and the ETag/Last-Modified validators.
+        The index is written after every change so interrupted runs keep
+        what they fetched.
+        
+        Args:
+            cache_dir: Directory holding the cache
+            max_age_seconds: How long a cached page is served without revalidating
+        """
+        self.cache_dir = cache_dir
+        self.max_age_seconds = max_age_seconds
+        self._indexes = {}
+        self.reset_stats()
+    
+    def reset_stats(self):
+        """
+        Reset the cache counters
+        
+        Every page looked up lands in exactly one bucket: hits (fresh entry),
+        revalidated (304), updated (200 replacing an entry), stale (entry served
+        because its URL expired or the refresh failed) or misses (no entry).
+        """
+        self.stats = {'hits': 0, 'revalidated': 0, 'updated': 0, 'stale': 0, 'misses': 0}
+    
+    def _index_path(self, doc_id: str) -> str:
+        doc_key = hashlib.sha256(str(doc_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'documents', f"{doc_key}.json")
+    
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', digest[:2], f"{digest}.txt")
+    
+    def _write_atomic(self, path: str, content: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    def _load_index(self, doc_id: str) -> Dict[str, Any]:
+        if doc_id not in self._indexes:
+            try:
+                with open(self._index_path(doc_id), 'r', encoding='utf-8') as f:
+                    self._indexes[doc_id] = json.load(f)
+            except (OSError, ValueError):
+                self._indexes[doc_id] = {}
+        return self._indexes[doc_id]
+    
+    @staticmethod
+    def source_for(url: Optional[str]) -> Optional[str]:
+        """Strip the signed query string, leaving the URL of the text object itself"""
+        if not url:
+            return None
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}{parts.path}"
+    
+    def get(self, doc_id: str, page_number: int, source: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for a page (with its 'text'), or None if absent or from another source"""
+        entry = self._load_index(doc_id).get(str(page_number))
+        if not entry or entry.get('source') != source:
+            return None
+        try:
+            with open(self._object_path(entry['sha256']), 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, KeyError):
+            return None
+        return dict(entry, text=text)
+    
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        """Check if a cached entry is young enough to serve without revalidation"""
+        return time.time() - entry.get('fetched_at', 0) < self.max_age_seconds
+    
+    def put(self, doc_id: str, page_number: int, text: str, source: Optional[str],
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Store page text, its source URL and its validators"""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, text)
+        self._load_index(doc_id)[str(page_number)] = {
+            'sha256': digest,
+            'source': source,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time(),
+        }
+        self.save(doc_id)
+    
+    def touch(self, doc_id: str, page_number: int,
+              etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Mark a cached entry as just revalidated, keeping any updated validators"""
+        entry = self._load_index(doc_id).get(str(page_number))
+        if entry:
+            entry['fetched_at'] = time.time()
+            if etag:
+                entry['etag'] = etag
+            if last_modified:
+                entry['last_modified'] = last_modified
+            self.save(doc_id)
+    
+    def save(self, doc_id: str):
+        """Write the document index to disk"""
+        if doc_id in self._indexes:
+            self._write_atomic(self._index_path(doc_id), json.dumps(self._indexes[doc_id], indent=2))
 
 class DirectPerusallExtractor:
-    def __init__(self, delay_seconds: float = 1.0):
+    def __init__(self, delay_seconds: float = 1.0, cache: Optional[PerusallPageCache] = None):
         """
         Initialize the extractor
         
         Args:
             delay_seconds: Delay between API requests to be respectful
+            cache: Local page text cache (None disables caching)
         """
         self.delay_seconds = delay_seconds
+        self.cache = cache
         self.session = requests.Session()
         # Add realistic headers
         self.session.headers.update({
@@ -149,46 +270,120 @@ class DirectPerusallExtractor:
         
         return text_content.strip()
     
-    def fetch_page_text(self, url: str, page_number: int) -> str:
-        """Fetch text content for a single page"""
+    def parse_page_response(self, response: requests.Response) -> str:
+        """Extract text from a page response, JSON or plain text"""
+        # Try to parse as JSON
+        try:
+            data = response.json()
+            text = self.extract_text_from_response(data)
+            
+            if text:
+                print(f"    ✓ Extracted {len(text)} characters")
+                return text
+            else:
+                print(f"    ⚠ No text found in response")
+                print(f"    Response keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
+                return ""
+                
+        except json.JSONDecodeError:
+            # If not JSON, treat as plain text
+            text = response.text.strip()
+            if text:
+                print(f"    ✓ Got plain text: {len(text)} characters")
+                return text
+            else:
+                print(f"    ⚠ Empty response")
+                return ""
+    
+    def fetch_page(self, url: str, headers: Optional[Dict[str, str]] = None) -> Tuple[str, Dict[str, Optional[str]], bool]:
+        """
+        Fetch a page, optionally with conditional request headers
+        
+        Returns:
+            (text, validators, not_modified) - validators holds the response's
+            'etag' and 'last_modified'; text is empty on failure or a 304
+        """
+        validators = {'etag': None, 'last_modified': None}
         try:
             print(f"    Requesting: {url[:100]}...")
             
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+            response = self.session.get(url, headers=headers, timeout=30)
+            validators['etag'] = response.headers.get('ETag')
+            validators['last_modified'] = response.headers.get('Last-Modified')
+            if response.status_code == 304:
+                return "", validators, True
             
-            # Try to parse as JSON
-            try:
-                data = response.json()
-                text = self.extract_text_from_response(data)
-                
-                if text:
-                    print(f"    ✓ Extracted {len(text)} characters")
-                    return text
-                else:
-                    print(f"    ⚠ No text found in response")
-                    print(f"    Response keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
-                    return ""
-                    
-            except json.JSONDecodeError:
-                # If not JSON, treat as plain text
-                text = response.text.strip()
-                if text:
-                    print(f"    ✓ Got plain text: {len(text)} characters")
-                    return text
-                else:
-                    print(f"    ⚠ Empty response")
-                    return ""
+            response.raise_for_status()
+            return self.parse_page_response(response), validators, False
             
         except requests.exceptions.Timeout:
             print(f"    ✗ Timeout after 30 seconds")
-            return ""
         except requests.exceptions.RequestException as e:
             print(f"    ✗ Request failed: {e}")
-            return ""
         except Exception as e:
             print(f"    ✗ Unexpected error: {e}")
-            return ""
+        return "", validators, False
+    
+    def fetch_page_text(self, url: str, page_number: int) -> str:
+        """Fetch text content for a single page"""
+        text, _, _ = self.fetch_page(url)
+        return text
+    
+    def fetch_page_text_cached(self, doc_id: str, page: Dict[str, Any], page_number: int,
+                               entry: Optional[Dict[str, Any]]) -> Tuple[str, bool]:
+        """
+        Fetch page text through the local cache
+        
+        Fresh entries are served without a request, older ones are revalidated
+        with ETag/Last-Modified, and entries whose signed URL has expired (or
+        whose refresh fails) are served stale. Pages with no entry are fetched
+        and stored; the caller counts them as misses.
+        
+        Returns:
+            (text, used_network) - text is empty if the page could not be obtained
+        """
+        cache = self.cache
+        url = page.get('textContentUrl')
+        source = cache.source_for(url)
+        expired = 'expiresAt' in page and self.is_url_expired(page['expiresAt'])
+        
+        if entry is None:
+            text, validators, _ = self.fetch_page(url)
+            if text:
+                cache.put(doc_id, page_number, text, source, **validators)
+            return text, True
+        
+        if cache.is_fresh(entry):
+            print(f"    ✓ Cache hit: {len(entry['text'])} characters")
+            cache.stats['hits'] += 1
+            return entry['text'], False
+        
+        if not url or expired:
+            print(f"    ✓ Serving stale cache (URL unavailable): {len(entry['text'])} characters")
+            cache.stats['stale'] += 1
+            return entry['text'], False
+        
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        
+        text, validators, not_modified = self.fetch_page(url, headers=headers)
+        if not_modified:
+            print(f"    ✓ Not modified, using cache: {len(entry['text'])} characters")
+            cache.touch(doc_id, page_number, **validators)
+            cache.stats['revalidated'] += 1
+            return entry['text'], True
+        
+        if text:
+            cache.put(doc_id, page_number, text, source, **validators)
+            cache.stats['updated'] += 1
+            return text, True
+        
+        print(f"    ✓ Serving stale cache after failed refresh: {len(entry['text'])} characters")
+        cache.stats['stale'] += 1
+        return entry['text'], True
     
     def extract_document(self, json_file_path: str, output_file: str = None) -> str:
         """Extract text from the entire document"""
@@ -206,6 +401,13 @@ class DirectPerusallExtractor:
         print("=" * 60)
         
         extracted_pages = []
+        # Without an _id there is no safe cache key, so fall back to plain fetching
+        cache_key = data.get('_id')
+        use_cache = self.cache is not None and bool(cache_key)
+        if use_cache:
+            self.cache.reset_stats()
+        elif self.cache is not None:
+            print("⚠ Document has no _id, page cache disabled")
         successful = 0
         failed = 0
         expired = 0
@@ -214,19 +416,29 @@ class DirectPerusallExtractor:
             page_num = page.get('number', i)
             print(f"\nPage {page_num} ({i}/{len(pages)}):")
             
-            if 'textContentUrl' not in page:
+            cached = None
+            if use_cache:
+                cached = self.cache.get(cache_key, page_num, self.cache.source_for(page.get('textContentUrl')))
+                if cached is None:
+                    self.cache.stats['misses'] += 1
+            
+            if 'textContentUrl' not in page and cached is None:
                 print(f"    ✗ No textContentUrl found")
                 failed += 1
                 continue
             
-            # Check expiration
-            if 'expiresAt' in page and self.is_url_expired(page['expiresAt']):
+            # Check expiration (a cached copy can still be served stale)
+            if 'expiresAt' in page and self.is_url_expired(page['expiresAt']) and cached is None:
                 print(f"    ✗ URL expired at {page['expiresAt']}")
                 expired += 1
                 continue
             
             # Fetch the text
-            text = self.fetch_page_text(page['textContentUrl'], page_num)
+            if use_cache:
+                text, used_network = self.fetch_page_text_cached(cache_key, page, page_num, cached)
+            else:
+                text = self.fetch_page_text(page['textContentUrl'], page_num)
+                used_network = True
             
             if text:
                 extracted_pages.append(f"=== PAGE {page_num} ===\n\n{text}")
@@ -235,7 +447,7 @@ class DirectPerusallExtractor:
                 failed += 1
             
             # Be respectful with delays
-            if i < len(pages):
+            if used_network and i < len(pages):
                 time.sleep(self.delay_seconds)
         
         print("\n" + "=" * 60)
@@ -244,6 +456,10 @@ class DirectPerusallExtractor:
         print(f"  ✗ Failed: {failed}")
         print(f"  ⏰ Expired: {expired}")
         print(f"  📄 Total pages: {len(pages)}")
+        if use_cache:
+            stats = self.cache.stats
+            print(f"  🗄  Cache: {stats['hits']} hits, {stats['revalidated']} revalidated, "
+                  f"{stats['updated']} updated, {stats['stale']} stale, {stats['misses']} misses")
         
         if not extracted_pages:
             raise ValueError("No pages could be extracted. Check if URLs have expired or are accessible.")
@@ -313,7 +529,7 @@ def main():
     
     try:
         # Extract the text
-        extractor = DirectPerusallExtractor(delay_seconds=0.8)
+        extractor = DirectPerusallExtractor(delay_seconds=0.8, cache=PerusallPageCache())
         text = extractor.extract_document(json_file, output_file)
         
         print(f"\n🎉 EXTRACTION COMPLETE!")
@@ -340,7 +556,7 @@ def main():
         print(f"\n🔧 Troubleshooting:")
         print(f"   • Make sure '{json_file}' is a valid Perusall JSON export")
         print(f"   • Check your internet connection")
-        print(f"   • The URLs in the JSON file might have expired")
+        print(f"   • The URLs in the JSON file might have expired (cached pages in .perusall_cache/ are still used)")
         print(f"   • Try re-exporting from Perusall if URLs are old")
 
 if __name__ == "__main__":
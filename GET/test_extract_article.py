@@ -0,0 +1,215 @@
+import json
+
+import pytest
+import requests
+
+from extract_article import DirectPerusallExtractor, PerusallPageCache
+
+FUTURE = "2999-01-01T00:00:00Z"
+PAST = "2000-01-01T00:00:00Z"
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, headers=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        self.text = json.dumps(payload) if payload is not None else ""
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+
+
+class FakeSession:
+    """Stands in for requests.Session, serving page text keyed by URL path"""
+
+    def __init__(self):
+        self.pages = {}
+        self.etags = {}
+        self.failing = set()
+        self.calls = []
+
+    def get(self, url, headers=None, timeout=None):
+        headers = headers or {}
+        self.calls.append((url, headers))
+        path = PerusallPageCache.source_for(url)
+        if path in self.failing:
+            return FakeResponse(500)
+        etag = self.etags.get(path)
+        if etag and headers.get('If-None-Match') == etag:
+            return FakeResponse(304, headers={'ETag': etag})
+        return FakeResponse(200, {'text': [self.pages[path]]}, headers={'ETag': etag} if etag else {})
+
+
+def make_page(number, path, expires_at=FUTURE):
+    return {
+        'number': number,
+        'textContentUrl': f"https://cdn.example/text-content/{path}.json?Expires=1&Signature=abc",
+        'expiresAt': expires_at,
+    }
+
+
+def source(path):
+    return f"https://cdn.example/text-content/{path}.json"
+
+
+@pytest.fixture
+def session():
+    return FakeSession()
+
+
+@pytest.fixture
+def extract(tmp_path, session):
+    def run(doc, max_age_seconds=3600):
+        doc_path = tmp_path / "doc.json"
+        doc_path.write_text(json.dumps(doc), encoding='utf-8')
+        cache = PerusallPageCache(str(tmp_path / "cache"), max_age_seconds=max_age_seconds)
+        extractor = DirectPerusallExtractor(delay_seconds=0, cache=cache)
+        extractor.session = session
+        session.calls.clear()
+        try:
+            text = extractor.extract_document(str(doc_path))
+        except ValueError:
+            text = ""
+        return text, cache.stats
+    return run
+
+
+def test_second_run_is_served_from_cache_without_requests(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    doc = {'_id': 'D', 'pages': [make_page(1, "D/p1")]}
+
+    _, stats = extract(doc)
+    assert stats['misses'] == 1
+
+    text, stats = extract(doc)
+    assert "hello 1" in text
+    assert stats['hits'] == 1
+    assert session.calls == []
+
+
+def test_changed_source_url_is_a_miss(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    session.pages[source("D/p9")] = "hello 9"
+    extract({'_id': 'D', 'pages': [make_page(1, "D/p1")]})
+
+    text, stats = extract({'_id': 'D', 'pages': [make_page(1, "D/p9")]})
+    assert "hello 9" in text and "hello 1" not in text
+    assert stats['misses'] == 1
+
+
+def test_changed_source_url_is_not_served_stale(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    extract({'_id': 'D', 'pages': [make_page(1, "D/p1")]})
+
+    text, stats = extract({'_id': 'D', 'pages': [make_page(1, "D/p9", PAST)]})
+    assert "hello 1" not in text
+    assert stats['stale'] == 0 and stats['misses'] == 1
+
+
+def test_revalidation_with_304_keeps_text_and_updates_validators(extract, session, tmp_path):
+    session.pages[source("D/p1")] = "hello 1"
+    session.etags[source("D/p1")] = '"v1"'
+    doc = {'_id': 'D', 'pages': [make_page(1, "D/p1")]}
+    extract(doc)
+
+    text, stats = extract(doc, max_age_seconds=0)
+    assert "hello 1" in text
+    assert stats['revalidated'] == 1
+    assert session.calls[0][1]['If-None-Match'] == '"v1"'
+
+    class RotatingEtagSession(FakeSession):
+        def get(self, url, headers=None, timeout=None):
+            self.calls.append((url, headers or {}))
+            return FakeResponse(304, headers={'ETag': '"v2"'})
+
+    rotating = RotatingEtagSession()
+    cache = PerusallPageCache(str(tmp_path / "cache"), max_age_seconds=0)
+    extractor = DirectPerusallExtractor(delay_seconds=0, cache=cache)
+    extractor.session = rotating
+    extractor.extract_document(str(tmp_path / "doc.json"))
+    assert cache.get('D', 1, source("D/p1"))['etag'] == '"v2"'
+
+
+def test_changed_content_is_counted_as_updated(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    session.etags[source("D/p1")] = '"v1"'
+    doc = {'_id': 'D', 'pages': [make_page(1, "D/p1")]}
+    extract(doc)
+
+    session.pages[source("D/p1")] = "hello again"
+    session.etags[source("D/p1")] = '"v2"'
+    text, stats = extract(doc, max_age_seconds=0)
+    assert "hello again" in text
+    assert stats['updated'] == 1
+
+
+def test_expired_url_serves_stale_entry(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    extract({'_id': 'D', 'pages': [make_page(1, "D/p1")]})
+
+    text, stats = extract({'_id': 'D', 'pages': [make_page(1, "D/p1", PAST)]}, max_age_seconds=0)
+    assert "hello 1" in text
+    assert stats['stale'] == 1
+    assert session.calls == []
+
+
+def test_failed_refresh_serves_stale_entry(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    doc = {'_id': 'D', 'pages': [make_page(1, "D/p1")]}
+    extract(doc)
+
+    session.failing.add(source("D/p1"))
+    text, stats = extract(doc, max_age_seconds=0)
+    assert "hello 1" in text
+    assert stats['stale'] == 1
+
+
+@pytest.mark.parametrize("doc_id", [None, "", "missing"])
+def test_documents_without_id_bypass_cache(extract, session, tmp_path, doc_id):
+    session.pages[source("A/p1")] = "text A"
+    session.pages[source("B/p1")] = "text B"
+
+    def doc(path):
+        data = {'pages': [make_page(1, path)]}
+        if doc_id != "missing":
+            data['_id'] = doc_id
+        return data
+
+    extract(doc("A/p1"))
+    text, _ = extract(doc("B/p1"))
+    assert "text B" in text and "text A" not in text
+    assert len(session.calls) == 1
+    assert not (tmp_path / "cache" / "documents").exists()
+
+
+def test_distinct_ids_do_not_share_an_index(extract, session):
+    session.pages[source("D/p1")] = "text D"
+    session.pages[source("E/p1")] = "text E"
+    extract({'_id': 'D', 'pages': [make_page(1, "D/p1")]})
+
+    text, stats = extract({'_id': 'D!', 'pages': [make_page(1, "E/p1")]})
+    assert "text E" in text
+    assert stats['misses'] == 1
+
+
+def test_stats_sum_to_page_count(extract, session):
+    session.pages[source("D/p1")] = "hello 1"
+    session.pages[source("D/p2")] = "hello 2"
+    session.failing.add(source("D/p3"))
+    pages = [
+        make_page(1, "D/p1"),
+        make_page(2, "D/p2"),
+        make_page(3, "D/p3"),
+        make_page(4, "D/p4", PAST),
+        {'number': 5},
+    ]
+    doc = {'_id': 'D', 'pages': pages}
+
+    for max_age in (3600, 3600, 0):
+        _, stats = extract(doc, max_age_seconds=max_age)
+        assert sum(stats.values()) == len(pages)